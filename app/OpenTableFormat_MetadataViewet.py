@@ -3,14 +3,28 @@ st.set_page_config(layout="wide")
 
 from snowflake.snowpark.context import get_active_session
 import pandas as pd
+import numpy as np
 import re
 import os
 import json
+import io
+import math
+import contextlib
+import atexit
+import threading
+import hashlib
+from collections import OrderedDict
+from datetime import datetime
 import tempfile
 import shutil
 import pyarrow.parquet as pq
+import pyarrow.compute as pc
 import pyarrow
 import fastavro
+try:
+    import orjson
+except ImportError:  # orjson not selected in the app's packages; use the stdlib parser
+    orjson = None
 
 # ---------- Session & UI header ----------
 session = get_active_session()
@@ -19,74 +33,291 @@ st.write("Safely explore Iceberg metadata and preview JSON, AVRO, and Parquet fi
 
 
 # ---------- Helpers ----------
+PREVIEW_LIMIT = 10_000     # max records loaded for JSON/AVRO previews
+PREVIEW_MAX_BYTES = 32 * 1024 * 1024  # max encoded AVRO block bytes decoded for a preview
+AI_SAMPLE_RECORDS = 20     # records handed to Cortex; the prompt is truncated anyway
+AI_SAMPLE_ROW_GROUPS = 3   # Parquet row groups handed to Cortex
+MAX_DROPDOWN_FILES = 500   # larger listings default to "Search by Name"
+# Smaller stage files are read without touching disk; override with METADATA_VIEWER_IN_MEMORY_MAX_BYTES
+IN_MEMORY_MAX_BYTES = int(os.environ.get("METADATA_VIEWER_IN_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+SAMPLE_ROWS = 100          # rows shown in the Parquet sample preview
+SCRATCH_MAX_BYTES = 500 * 1024 * 1024  # downloaded files kept across all sessions before LRU eviction
+PARQUET_MEMO_MAX_FILES = 16  # parsed Parquet footers kept per session before LRU eviction
+
+# One str.translate pass maps every C0/C1 control char (incl. \n, \r, \t) to a space;
+# _WS_RE then collapses runs. The prompt is a bound parameter, so no quote escaping is needed.
+_CORTEX_TABLE = {c: 0x20 for c in list(range(0x00, 0x20)) + list(range(0x7f, 0xa0))}
+_WS_RE = re.compile(r'\s{2,}')
+
+_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+# DDL property extractors
+_EXT_VOL_RE = re.compile(r"EXTERNAL_VOLUME\s*=\s*['\"]([^'\"]+)['\"]", re.IGNORECASE)
+_CATALOG_RE = re.compile(r"CATALOG\s*=\s*['\"]([^'\"]+)['\"]", re.IGNORECASE)
+_BASE_LOC_RE = re.compile(r"BASE_LOCATION\s*=\s*['\"]([^'\"]+)['\"]", re.IGNORECASE)
+
 def format_bytes(size):
-    for unit in ['B','KB','MB','GB','TB']:
-        if size is None:
-            return "N/A"
-        try:
-            size = float(size)
-        except Exception:
-            return str(size)
-        if size < 1024:
-            return f"{size:.2f} {unit}"
-        size /= 1024
-    return f"{size:.2f} PB"
+    if size is None:
+        return "N/A"
+    try:
+        size = float(size)
+    except Exception:
+        return str(size)
+    # floor(log2(size)) // 10 is the 1024-based unit index; frexp gives the exponent exactly
+    i = min((math.frexp(size)[1] - 1) // 10, len(_UNITS) - 1) if math.isfinite(size) and size >= 1024 else 0
+    return f"{size / (1 << (10 * i)):.2f} {_UNITS[i]}"
+
+def format_bytes_array(sizes):
+    # Vectorized format_bytes for whole columns (e.g. LS sizes); same units and rounding
+    sizes = np.asarray(sizes, dtype=float)
+    exponents = np.frexp(sizes)[1]
+    idx = np.where(np.isfinite(sizes) & (sizes >= 1024), np.minimum((exponents - 1) // 10, len(_UNITS) - 1), 0)
+    return np.char.add(np.char.mod('%.2f ', sizes / np.power(1024.0, idx)), np.array(_UNITS)[idx])
 
 def format_dates(dt_str):
+    # datetime / ISO strings skip pandas' parsing machinery; anything else falls back to it
+    try:
+        if isinstance(dt_str, datetime):
+            return dt_str.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(dt_str, str):
+            return datetime.fromisoformat(dt_str.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        pass
     try:
         return pd.to_datetime(dt_str).strftime('%Y-%m-%d %H:%M:%S')
     except Exception:
         return str(dt_str)
 
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj, indent=False):
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=str, option=option).decode()
+    return json.dumps(obj, default=str, ensure_ascii=False, indent=2 if indent else None)
+
+def open_source(source):
+    # Downloaded files are local paths; small files arrive as an in-memory buffer
+    if isinstance(source, str):
+        return open(source, "rb")
+    source.seek(0)
+    return contextlib.nullcontext(source)
+
+@st.cache_resource(show_spinner=False)
+def _scratch_store():
+    # One scratch dir and LRU for the whole process: SCRATCH_MAX_BYTES bounds all sessions together,
+    # including ones that have ended, and the dir is removed when the app exits
+    scratch = tempfile.mkdtemp(prefix="sf_stage_")
+    atexit.register(shutil.rmtree, scratch, ignore_errors=True)
+    return {"dir": scratch, "downloads": OrderedDict(), "lock": threading.Lock()}
+
+def download_to_scratch(stage_file: str, stage_key=None) -> str:
+    # Files are kept (LRU by total size) so re-selecting an unchanged file skips the download
+    # and reuses the OS page cache
+    store = _scratch_store()
+    downloads = store["downloads"]
+    # Without an LS size/timestamp the local copy can't be trusted to be current, so it is fetched again
+    key = stage_key if stage_key is not None else (stage_file, None, None)
+    with store["lock"]:
+        if stage_key is not None and key in downloads and os.path.exists(downloads[key]):
+            downloads.move_to_end(key)
+            return downloads[key]
+
+        # Keep one local copy per stage file: older versions are dropped before the new one lands
+        for old_key in [k for k in downloads if k[0] == stage_file]:
+            shutil.rmtree(os.path.dirname(downloads.pop(old_key)), ignore_errors=True)
+
+        target_dir = os.path.join(store["dir"], hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16])
+        os.makedirs(target_dir, exist_ok=True)
+        session.file.get(stage_file, target_dir)
+        local_path = os.path.join(target_dir, os.path.basename(stage_file))
+        downloads[key] = local_path
+
+        total = sum(os.path.getsize(p) for p in downloads.values() if os.path.exists(p))
+        while total > SCRATCH_MAX_BYTES and len(downloads) > 1:
+            _, old_path = downloads.popitem(last=False)
+            if os.path.exists(old_path):
+                total -= os.path.getsize(old_path)
+            shutil.rmtree(os.path.dirname(old_path), ignore_errors=True)
+        return local_path
+
+def arrow_source(source):
+    # pyarrow opens local paths itself; in-memory bytes are wrapped zero-copy, not via a Python file object
+    return source if isinstance(source, str) else pyarrow.BufferReader(source.getbuffer())
+
+def format_date_columns(df, columns):
+    # Vectorized formatting; format_dates only handles what pandas can't coerce
+    for c in columns:
+        formatted = pd.to_datetime(df[c], errors="coerce").dt.strftime('%Y-%m-%d %H:%M:%S')
+        fallback = formatted.isna() & df[c].notna()
+        if fallback.any():
+            formatted[fallback] = df.loc[fallback, c].map(format_dates)
+        df[c] = formatted
+    return df
+
 def cleanse_for_cortex(record, max_len=2000):
     try:
-        s = json.dumps(record, default=str, ensure_ascii=False)
+        s = json_dumps(record)
     except Exception:
         s = str(record)
-    s = s.replace("'", "''")
-    s = re.sub(r'[\n\r\t]+', ' ', s)
-    s = re.sub(r'[\x00-\x1f\x7f-\x9f]+', ' ', s)
-    s = re.sub(r'\s{2,}', ' ', s)
-    return s[:max_len]
+    return _WS_RE.sub(' ', s.translate(_CORTEX_TABLE))[:max_len]
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cortex_complete(safe_text: str):
+    # Keyed on the cleansed prompt text, so re-summarizing the same file reuses the response
+    sql_ai = """
+        SELECT SNOWFLAKE.CORTEX.COMPLETE('mistral-large', ?) AS MODEL_OUTPUT
+    """
+    prompt = f"Can you summarize the output here in bullets?: {safe_text}"
+    df_ai = session.sql(sql_ai, params=[prompt]).to_pandas()
+    if 'MODEL_OUTPUT' in df_ai.columns:
+        return df_ai.iloc[0]['MODEL_OUTPUT']
+    return df_ai.iloc[0,0]
 
 def safe_cortex_call(record):
+    # Subset structurally before serializing; the prompt is cut to 3000 chars regardless
+    if isinstance(record, list):
+        record = record[:AI_SAMPLE_RECORDS]
+    elif isinstance(record, dict) and 'row_groups' in record:
+        record = {**record, 'row_groups': record['row_groups'][:AI_SAMPLE_ROW_GROUPS]}
     try:
-        safe_text = cleanse_for_cortex(record, max_len=3000)
-        sql_ai = f"""
-            SELECT SNOWFLAKE.CORTEX.COMPLETE(
-                'mistral-large',
-                'Can you summarize the output here in bullets?: {safe_text}'
-            ) AS MODEL_OUTPUT;
-        """
-        df_ai = session.sql(sql_ai).to_pandas()
-        if 'MODEL_OUTPUT' in df_ai.columns:
-            return df_ai.iloc[0]['MODEL_OUTPUT']
-        return df_ai.iloc[0,0]
+        return _cortex_complete(cleanse_for_cortex(record, max_len=3000))
     except Exception as e:
         return f"AI summary skipped: {e}"
 
+# ---------- Cached Snowflake lookups ----------
+def _quote_ident(name: str) -> str:
+    # Identifiers can't be bound as parameters; quote them instead of interpolating raw text
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _stage_path_literal(stage: str, relative_prefix: str = "") -> str:
+    # Quoted so prefixes with spaces or special characters survive LS; backslashes and quotes are escaped
+    path = f"@{stage}/{relative_prefix}" if relative_prefix else f"@{stage}"
+    return "'" + path.replace("\\", "\\\\").replace("'", "''") + "'"
+
+# Every widget interaction reruns the script; these keep reruns off the network.
+# The "Refresh Metadata" button clears them on demand.
+@st.cache_data(ttl=600, show_spinner=False)
+def _list_databases():
+    # collect() + the one column needed avoids materializing the whole SHOW result in pandas
+    rows = [r.as_dict() for r in session.sql("SHOW DATABASES").collect()]
+    if not rows:
+        return []
+    name_key = next((k for k in ('name', '"name"') if k in rows[0]), next(iter(rows[0])))
+    return sorted(r[name_key] for r in rows)
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _list_iceberg_tables(db: str):
+    iceberg_query = f"""
+        SELECT (TABLE_CATALOG||'.'||TABLE_SCHEMA||'.'||TABLE_NAME) AS TABLE_NAME,
+               ROW_COUNT,BYTES,CREATED,LAST_DDL,IS_DYNAMIC
+        FROM {_quote_ident(db)}.INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_TYPE='BASE TABLE' AND IS_ICEBERG='YES'
+    """
+    result = session.sql(iceberg_query)
+    # Keep the listing in Arrow; only the selected row is converted to pandas later
+    if hasattr(result, "to_arrow"):
+        tables = result.to_arrow()
+    else:
+        tables = pyarrow.Table.from_pandas(result.to_pandas(), preserve_index=False)
+    return tables.take(pc.sort_indices(tables.column('TABLE_NAME')))
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _get_table_ddl(table: str):
+    ddl_df = session.sql("SELECT GET_DDL('TABLE', ?) AS DDL", params=[table]).to_pandas()
+    return ddl_df['DDL'][0]
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _get_iceberg_table_location(table: str):
+    # SHOW ICEBERG TABLES exposes these as columns, sparing a GET_DDL round trip and regex scans
+    db, schema, name = table.split(".", 2)
+    like_name = name.replace("'", "''")
+    show_df = session.sql(
+        f"SHOW ICEBERG TABLES LIKE '{like_name}' IN SCHEMA {_quote_ident(db)}.{_quote_ident(schema)}"
+    ).to_pandas()
+    show_df.columns = show_df.columns.str.strip('"').str.lower()
+    if show_df.empty or 'name' not in show_df.columns:
+        return {}
+    show_df = show_df[show_df['name'] == name]
+    if show_df.empty:
+        return {}
+    row = show_df.iloc[0]
+    location = {}
+    for key, col in (("external_volume", "external_volume_name"), ("catalog", "catalog_name"),
+                     ("base_location", "base_location")):
+        value = row.get(col)
+        location[key] = value if isinstance(value, str) and value else None
+    return location
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _resolve_external_volume(volume_name: str):
+    ev_sql = """
+        SELECT S3_PATH
+        FROM METADATA_VIEWER_DB.APP_SETUP.EXTERNAL_VOLUME_PATHS
+        WHERE VOLUME_NAME=?
+    """
+    return session.sql(ev_sql, params=[volume_name]).to_pandas()
+
+@st.cache_data(ttl=600, show_spinner=False)
+def _list_stage_paths():
+    stage_sql = """
+        SELECT STAGE_NAME,DATABASE_NAME,SCHEMA_NAME,STAGE_URL
+        FROM METADATA_VIEWER_DB.APP_SETUP.STAGE_PATHS
+        WHERE STAGE_URL IS NOT NULL
+    """
+    return session.sql(stage_sql).to_pandas()
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _list_stage_files(stage: str, relative_prefix: str):
+    # Path-prefixed LS lets the stage list by prefix instead of regex-filtering every object
+    # LS is a command, so its result comes back as JSON rather than Arrow; to_pandas() handles both.
+    # The listing is then post-processed in Arrow and only the filtered result goes back to pandas.
+    ls_df = session.sql(f"LS {_stage_path_literal(stage, relative_prefix)}").to_pandas()
+    tbl = pyarrow.Table.from_pandas(ls_df, preserve_index=False)
+    tbl = tbl.rename_columns([c.strip('"').upper() for c in tbl.column_names])
+    if tbl.num_rows == 0 or 'NAME' not in tbl.column_names:
+        return tbl.to_pandas()
+    # Filter and label with Arrow string kernels rather than per-row pandas/Python work
+    names = tbl.column('NAME')
+    skip = pc.or_(pc.ends_with(names, '.crc'), pc.ends_with(names, '.bin'))
+    tbl = tbl.filter(pc.invert(skip))
+    label_parts = [tbl.column('NAME'), tbl.column('LAST_MODIFIED')]
+    if 'SIZE' in tbl.column_names:
+        label_parts.append(pyarrow.array(format_bytes_array(tbl.column('SIZE').to_numpy(zero_copy_only=False))))
+    # binary_join needs one string type; newer pandas hands Arrow large_string columns
+    labels = pc.binary_join_element_wise(*(pc.cast(p, pyarrow.string()) for p in label_parts), " | ")
+    return tbl.append_column('LABEL', labels).to_pandas()
+
 # ---------- Utility: Parquet metadata ----------
-def show_parquet_metadata(local_file_path: str):
-    parquet_file = pq.ParquetFile(local_file_path)
-    meta = parquet_file.metadata
+# `_source` is a local path or an in-memory buffer and `_footer` its parsed FileMetaData.
+# Streamlit skips hashing underscore arguments, so `file_key` (location, size, modification
+# stamp) is what the caches key on.
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _read_parquet_footer(_source, file_key: tuple):
+    # Footer only: no data reader is set up, and local files are memory-mapped rather than buffered
+    return pq.read_metadata(arrow_source(_source), memory_map=isinstance(_source, str))
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _parse_parquet_metadata(_footer, file_key: tuple):
+    meta = _footer
 
     overview = {
-        "file_path": local_file_path,
+        "file_path": file_key[0],
         "created_by": getattr(meta, "created_by", None),
         "num_rows": getattr(meta, "num_rows", None),
         "num_columns": getattr(meta, "num_columns", None),
         "num_row_groups": getattr(meta, "num_row_groups", None)
     }
 
-    schema_fields = []
-    arrow_schema = parquet_file.schema_arrow
-    for f in arrow_schema:
-        schema_fields.append({
-            "column": f.name,
-            "type": str(f.type),
-            "nullable": getattr(f, "nullable", None)
-        })
-    schema_df = pd.DataFrame(schema_fields)
+    # Column-oriented so the DataFrame is built in one shot, even for very wide schemas
+    arrow_schema = meta.schema.to_arrow_schema()
+    fields = [arrow_schema.field(i) for i in range(len(arrow_schema))]
+    schema_fields = {
+        "column": arrow_schema.names,
+        "type": [str(f.type) for f in fields],
+        "nullable": [f.nullable for f in fields]
+    }
 
     kv = {}
     try:
@@ -98,45 +329,80 @@ def show_parquet_metadata(local_file_path: str):
     except Exception:
         kv = {}
 
+    # Row-group headers only; per-column statistics are loaded on demand by get_rg_columns
     row_groups = []
     for i in range(meta.num_row_groups):
         rg = meta.row_group(i)
-        rg_info = {
+        row_groups.append({
             "num_rows": rg.num_rows,
-            "total_byte_size": rg.total_byte_size,
-            "columns": []
-        }
-        for j in range(rg.num_columns):
-            col = rg.column(j)
-            col_info = {
-                "path_in_schema": col.path_in_schema,
-                "physical_type": col.physical_type,
-                "compression": col.compression,
-                "encodings": col.encodings,
-                "statistics": None
-            }
+            "total_byte_size": rg.total_byte_size
+        })
+
+    return overview, schema_fields, kv, row_groups
+
+def rg_column_lists(rg):
+    # One pass over the row group into parallel column lists, ready for a single DataFrame build
+    paths, ptypes, comps, encs, nulls, dists, mins, maxs, nvals = ([] for _ in range(9))
+    for j in range(rg.num_columns):
+        col = rg.column(j)
+        stats = col.statistics if col.is_stats_set else None
+        paths.append(col.path_in_schema)
+        ptypes.append(col.physical_type)
+        comps.append(col.compression)
+        encs.append(", ".join(col.encodings or ()))
+        nulls.append(stats.null_count if stats is not None and stats.has_null_count else None)
+        dists.append(stats.distinct_count if stats is not None and stats.has_distinct_count else None)
+        nvals.append(stats.num_values if stats is not None else None)
+        col_min = col_max = None
+        if stats is not None and stats.has_min_max:
             try:
-                if col.statistics is not None:
-                    col_info["statistics"] = {
-                        "null_count": getattr(col.statistics, "null_count", None),
-                        "distinct_count": getattr(col.statistics, "distinct_count", None),
-                        "min": getattr(col.statistics, "min", None),
-                        "max": getattr(col.statistics, "max", None),
-                        "num_values": getattr(col.statistics, "num_values", None)
-                    }
+                col_min, col_max = stats.min, stats.max
             except (NotImplementedError, pyarrow.lib.ArrowNotImplementedError):
-                col_info["statistics"] = None
-            rg_info["columns"].append(col_info)
-        row_groups.append(rg_info)
+                pass
+        mins.append(col_min)
+        maxs.append(col_max)
+    return {
+        "path_in_schema": paths,
+        "physical_type": ptypes,
+        "compression": comps,
+        "encodings": encs,
+        "null_count": nulls,
+        "distinct_count": dists,
+        "min": mins,
+        "max": maxs,
+        "num_values": nvals
+    }
 
+@st.cache_data(show_spinner=False, max_entries=16)
+def get_rg_columns(_footer, file_key: tuple, rg_index: int):
+    # Cached for the row-group picker only; entries are per (file, row group)
+    return rg_column_lists(_footer.row_group(rg_index))
+
+def show_parquet_metadata(footer, file_key: tuple):
+    overview, schema_fields, kv, row_groups = _parse_parquet_metadata(footer, file_key)
     return {
         "overview": overview,
-        "schema_df": schema_df,
+        "schema_df": pd.DataFrame(schema_fields),
         "kv": kv,
         "row_groups": row_groups
     }
 
-def render_parquet_view(metadata_dict):
+def load_parquet_metadata(source, file_key: tuple, memo_key=None):
+    # Session-level memo on top of the cached parse, keyed by stage file + size + LAST_MODIFIED,
+    # so returning to a file needs neither a download nor a footer parse
+    memo = st.session_state.setdefault("_pq_meta", OrderedDict())
+    if memo_key is not None and memo_key in memo:
+        memo.move_to_end(memo_key)
+        return memo[memo_key]
+    footer = _read_parquet_footer(source, file_key)
+    entry = (show_parquet_metadata(footer, file_key), footer, file_key)
+    if memo_key is not None:
+        memo[memo_key] = entry
+        while len(memo) > PARQUET_MEMO_MAX_FILES:
+            memo.popitem(last=False)
+    return entry
+
+def render_parquet_view(metadata_dict, footer, file_key: tuple):
     st.subheader("📊 Parquet Metadata")
     with st.expander("**📝 Overview**", expanded=False):
         st.json(metadata_dict["overview"])
@@ -150,61 +416,46 @@ def render_parquet_view(metadata_dict):
             st.json(metadata_dict["kv"])
         else:
             st.write("No key-value metadata present.")
-    for i, rg in enumerate(metadata_dict["row_groups"], start=1):
-        with st.expander(f"**📦 Row Group {i}**", expanded=False):
-            rg_header = {
-                "num_rows": rg.get("num_rows"),
-                "total_byte_size": rg.get("total_byte_size")
-            }
-            st.write(rg_header)
-            cols = rg.get("columns", [])
-            rows = []
-            for c in cols:
-                stats = c.get("statistics") or {}
-                rows.append({
-                    "path_in_schema": c.get("path_in_schema"),
-                    "physical_type": c.get("physical_type"),
-                    "compression": c.get("compression"),
-                    "encodings": ", ".join(c.get("encodings", []) or []),
-                    "null_count": stats.get("null_count"),
-                    "distinct_count": stats.get("distinct_count"),
-                    "min": stats.get("min"),
-                    "max": stats.get("max"),
-                    "num_values": stats.get("num_values")
-                })
-            if rows:
-                st.dataframe(pd.DataFrame(rows))
+    row_groups = metadata_dict["row_groups"]
+    with st.expander("**📦 Row Groups**", expanded=False):
+        if row_groups:
+            # Expander bodies always run, so only the picked row group's statistics are decoded
+            rg_index = st.selectbox(
+                "Select a Row Group", range(len(row_groups)), format_func=lambda i: f"Row Group {i + 1}"
+            )
+            st.write(row_groups[rg_index])
+            cols = get_rg_columns(footer, file_key, rg_index)
+            if cols["path_in_schema"]:
+                st.dataframe(pd.DataFrame(cols))
             else:
                 st.write("No column-level details available for this row group.")
+        else:
+            st.write("No row groups present.")
     with st.expander("**📄 Raw Metadata JSON**", expanded=False):
-        st.json({
-            "schema": str(metadata_dict["schema_df"]),
-            "row_groups": metadata_dict["row_groups"]
-        })
-
-def render_json_avro_view(records: list, file_path: str):
+        # Only serialized on request, and sent as one compact string rather than a nested dict
+        if st.button("Show raw metadata", key="raw_parquet_meta"):
+            raw_row_groups = []
+            for i, rg in enumerate(row_groups):
+                # Walked directly: routing every row group through get_rg_columns would churn its cache
+                cols = rg_column_lists(footer.row_group(i))
+                raw_row_groups.append({**rg, "columns": [dict(zip(cols, values)) for values in zip(*cols.values())]})
+            raw_json = json_dumps({
+                "schema": str(metadata_dict["schema_df"]),
+                "row_groups": raw_row_groups
+            }, indent=True)
+            st.code(raw_json, language="json")
+
+def render_json_avro_view(records: list, raw_obj=None, truncated=False):
     st.subheader("📄 File Information")
+    if truncated:
+        st.caption(f"Showing the first {len(records)} records. The file holds more than the preview loads.")
     with st.expander("**📄 Raw File View**", expanded=False):
+        # Render what the caller already parsed instead of re-reading the file
+        raw = raw_obj if raw_obj is not None else records
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                try:
-                    obj = json.load(f)
-                    records = obj if isinstance(obj, list) else [obj]
-                except json.JSONDecodeError:
-                    f.seek(0)
-                    for line in f:
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            records.append(json.loads(line))
-                        except Exception:
-                            records.append({"raw_line": line})
-
-            st.json(records if records else {"info": "No valid records found"})
-
+            st.json(raw if raw else {"info": "No valid records found"})
         except Exception as e:
-            st.write(f"Unable to load JSON: {e}")
+            st.write(f"Unable to render JSON: {e}")
             st.write(records if records else "No records available")
 
     with st.expander("**🧾 Tabular Format**", expanded=False):
@@ -219,18 +470,16 @@ def render_json_avro_view(records: list, file_path: str):
 # ---------- Database selection ----------
 st.subheader("📦 Select Iceberg Table")
 
+if st.button("🔄 Refresh Metadata", help="Clear cached Snowflake lookups and re-query"):
+    for cached_fn in (_list_databases, _list_iceberg_tables, _get_table_ddl, _get_iceberg_table_location,
+                      _resolve_external_volume, _list_stage_paths, _list_stage_files):
+        cached_fn.clear()
+
 col1, col2 = st.columns([1,3])
 
 with st.spinner("Fetching databases..."):
     try:
-        databases = session.sql("SHOW DATABASES").to_pandas()
-        if '"name"' in databases.columns:
-            db_list = databases['"name"'].tolist()
-        elif 'name' in databases.columns:
-            db_list = databases['name'].tolist()
-        else:
-            db_list = databases.iloc[:,0].tolist()
-        db_names = ['Select One'] + sorted(db_list)
+        db_names = ['Select One'] + _list_databases()
     except Exception as e:
         st.error(f"Error retrieving databases: {e}")
         st.stop()
@@ -254,15 +503,9 @@ with col1:
 # ---------- Iceberg Tables ----------
 try:
     with st.spinner("Fetching Iceberg tables..."):
-        iceberg_query = f"""
-            SELECT (TABLE_CATALOG||'.'||TABLE_SCHEMA||'.'||TABLE_NAME) AS TABLE_NAME,
-                   ROW_COUNT,BYTES,CREATED,LAST_DDL,IS_DYNAMIC
-            FROM {selected_db}.INFORMATION_SCHEMA.TABLES
-            WHERE TABLE_TYPE='BASE TABLE' AND IS_ICEBERG='YES'
-        """
-        iceberg_tables = session.sql(iceberg_query).to_pandas()
-
-    if iceberg_tables.empty:
+        iceberg_tables = _list_iceberg_tables(selected_db)
+
+    if iceberg_tables.num_rows == 0:
         st.warning(f"No Iceberg tables found in database `{selected_db}`.")
         st.stop()
 
@@ -275,7 +518,7 @@ if "selected_table_final" not in st.session_state:
     st.session_state.selected_table_final = None
 
 with col2:
-    selected_table_choice = st.selectbox("**Select an Iceberg Table**", ['Select One'] + sorted(iceberg_tables['TABLE_NAME'].tolist()), key="selected_table_choice")
+    selected_table_choice = st.selectbox("**Select an Iceberg Table**", ['Select One'] + iceberg_tables.column('TABLE_NAME').to_pylist(), key="selected_table_choice")
 
 if st.button("Submit Table", type="primary"):
     if selected_table_choice != "Select One":
@@ -290,11 +533,11 @@ if not selected_table:
     st.stop()
 
 # ---------- Show selected table metadata ----------
-table_info = iceberg_tables[iceberg_tables['TABLE_NAME'] == selected_table]
+table_info = iceberg_tables.filter(pc.equal(iceberg_tables.column('TABLE_NAME'), selected_table)).to_pandas()
 if table_info.empty:
     st.error(f"Selected table `{selected_table}` not found.")
     st.stop()
-table_info = table_info.iloc[0]
+table_info = format_date_columns(table_info, ("CREATED", "LAST_DDL")).iloc[0]
 
 #st.subheader(f"Metadata for {selected_table}")
 #st.success(f"Table Selected {selected_table}")
@@ -302,32 +545,45 @@ with st.expander(f"🔍 **Metadata for Table**", expanded=False):
     st.write(f"**Table Name:** {table_info['TABLE_NAME']}")
     st.write(f"**Row Count:** {table_info['ROW_COUNT']}")
     st.write(f"**Size:** {format_bytes(table_info['BYTES'])}")
-    st.write(f"**Created:** {format_dates(table_info['CREATED'])}")
-    st.write(f"**Last DDL:** {format_dates(table_info['LAST_DDL'])}")
+    st.write(f"**Created:** {table_info['CREATED']}")
+    st.write(f"**Last DDL:** {table_info['LAST_DDL']}")
     st.write(f"**Is Dynamic:** {table_info['IS_DYNAMIC']}")
 
 # ---------- Extract DDL Details ----------
 with st.spinner("Extracting DDL details..."):
     try:
-        ddl_df = session.sql(f"SELECT GET_DDL('TABLE','{selected_table}') AS DDL").to_pandas()
-        ddl = ddl_df['DDL'][0]
+        ddl = None
+        try:
+            location = _get_iceberg_table_location(selected_table)
+        except Exception:
+            location = {}
+        external_volume_name = location.get("external_volume")
+        catalog_name = location.get("catalog")
+        base_location = location.get("base_location")
+
+        # Fall back to parsing the DDL when SHOW ICEBERG TABLES did not provide the properties
+        if not external_volume_name or not base_location:
+            ddl = _get_table_ddl(selected_table)
 
-        ev_match = re.search(r"EXTERNAL_VOLUME\s*=\s*['\"]([^'\"]+)['\"]", ddl, re.IGNORECASE)
-        external_volume_name = ev_match.group(1) if ev_match else None
+            if not external_volume_name:
+                ev_match = _EXT_VOL_RE.search(ddl)
+                external_volume_name = ev_match.group(1) if ev_match else None
 
-        catalog_match = re.search(r"CATALOG\s*=\s*['\"]([^'\"]+)['\"]", ddl, re.IGNORECASE)
-        catalog_name = catalog_match.group(1) if catalog_match else None
+            if not catalog_name:
+                catalog_match = _CATALOG_RE.search(ddl)
+                catalog_name = catalog_match.group(1) if catalog_match else None
 
-        base_loc_match = re.search(r"BASE_LOCATION\s*=\s*['\"]([^'\"]+)['\"]", ddl, re.IGNORECASE)
-        base_location = base_loc_match.group(1) if base_loc_match else None
+            if not base_location:
+                base_loc_match = _BASE_LOC_RE.search(ddl)
+                base_location = base_loc_match.group(1) if base_loc_match else None
 
         # Clean up
         if external_volume_name:
-            external_volume_name = external_volume_name.rstrip("/*").rstrip("/")
+            external_volume_name = external_volume_name.rstrip("/*")
         if base_location:
-            base_location = base_location.rstrip("/*").rstrip("/")
+            base_location = base_location.rstrip("/*")
         if catalog_name:
-            catalog_name = catalog_name.rstrip("/*").rstrip("/")
+            catalog_name = catalog_name.rstrip("/*")
 
         #st.subheader("📂 External Volume, Catalog & Location Information")
         with st.expander("📂 **External Volume, Catalog & Location Information**", expanded=False):
@@ -338,10 +594,8 @@ with st.spinner("Extracting DDL details..."):
     except Exception as e:
         st.error(f"Error extracting DDL details: {e}")
         # show partial DDL when available for debugging
-        try:
+        if ddl:
             st.code(ddl)
-        except Exception:
-            pass
         st.stop()
 
 # ---------- Resolve Stage ----------
@@ -351,30 +605,24 @@ with st.spinner("Resolving Stage..."):
             st.error("External volume name not found in DDL.")
             st.stop()
 
-        ev_sql = f"""
-            SELECT S3_PATH
-            FROM METADATA_VIEWER_DB.APP_SETUP.EXTERNAL_VOLUME_PATHS
-            WHERE VOLUME_NAME='{external_volume_name}'
-        """
-        ev_df = session.sql(ev_sql).to_pandas()
+        ev_df = _resolve_external_volume(external_volume_name)
         if ev_df.empty:
             st.error(f"S3_PATH not found for External Volume: {external_volume_name}")
             st.stop()
-        ev_s3_path = ev_df['S3_PATH'].iloc[0].rstrip("/*").rstrip("/")
-
-        stage_sql = f"""
-            SELECT STAGE_NAME,DATABASE_NAME,SCHEMA_NAME,STAGE_URL
-            FROM METADATA_VIEWER_DB.APP_SETUP.STAGE_PATHS
-            WHERE STAGE_URL IS NOT NULL
-        """
-        stage_df = session.sql(stage_sql).to_pandas()
+        ev_s3_path = ev_df['S3_PATH'].iloc[0].rstrip("/*")
+
+        stage_df = _list_stage_paths()
         resolved_stage = None
         stage_url = None
-        # Find the stage whose STAGE_URL is the prefix of the S3 path
-        for idx, row in stage_df.iterrows():
-            stage_url_candidate = row['STAGE_URL'].rstrip("/*").rstrip("/")
+        # Find the stage whose STAGE_URL is the longest prefix of the S3 path
+        candidates = sorted(
+            ((u.rstrip("/*"), d, sc, n) for u, d, sc, n in zip(
+                stage_df['STAGE_URL'], stage_df['DATABASE_NAME'], stage_df['SCHEMA_NAME'], stage_df['STAGE_NAME'])),
+            key=lambda c: -len(c[0])
+        )
+        for stage_url_candidate, db_name, schema_name, stage_name in candidates:
             if ev_s3_path == stage_url_candidate or ev_s3_path.startswith(stage_url_candidate + "/"):
-                resolved_stage = f"{row['DATABASE_NAME']}.{row['SCHEMA_NAME']}.{row['STAGE_NAME']}"
+                resolved_stage = f"{db_name}.{schema_name}.{stage_name}"
                 stage_url = stage_url_candidate
                 break
 
@@ -412,15 +660,11 @@ with st.spinner("Resolving Stage..."):
                 parts.append(base_location.lstrip("/").rstrip("/"))
             relative_prefix = "/".join([p for p in parts if p]).strip("/")
     
-            # Build LS PATTERN
-            if relative_prefix:
-                escaped = re.escape(relative_prefix)
-                ls_pattern = f"^{relative_prefix}.*"
-            else:
-                ls_pattern = ".*"
+            # Build LS path (prefix listing)
+            ls_path = _stage_path_literal(resolved_stage, relative_prefix)
     
-            st.write(f"**Relative Prefix Used in Pattern:** `{relative_prefix}`")
-            st.write(f"**Final LS PATTERN:** `{ls_pattern}`")
+            st.write(f"**Relative Prefix Used in LS Path:** `{relative_prefix}`")
+            st.write(f"**Final LS Path:** `{ls_path}`")
 
     except Exception as e:
         st.error(f"Error resolving stage/external volume: {e}")
@@ -429,141 +673,211 @@ with st.spinner("Resolving Stage..."):
 # ---------- List files ----------
 with st.spinner("Listing files..."):
     try:
-        ls_sql = f"LS @{resolved_stage} PATTERN='{ls_pattern}'"
-        files_df = session.sql(ls_sql).to_pandas()
+        files_df = _list_stage_files(resolved_stage, relative_prefix)
         if files_df.empty:
             st.warning("No files found at the base location.")
             st.stop()
-        files_df.columns = [c.strip('"').upper() for c in files_df.columns]
         if 'NAME' not in files_df.columns:
             st.error("LS result did not include NAME column; raw result preview:")
             st.write(files_df.head(10))
             st.stop()
-        files_df = files_df[~files_df['NAME'].str.endswith(('.crc', '.bin'))]
-        files_df['LABEL'] = files_df['NAME'] + " | " + files_df['LAST_MODIFIED'].astype(str)
         file_labels = sorted(files_df['LABEL'].tolist())
     except Exception as e:
         st.error(f"Error listing files from stage: {e}")
         st.stop()
 
 # ---------- File Selection ----------
-st.subheader("📄 Select or Search File")
-file_selection_method = st.radio("Choose file selection method:", ["Dropdown", "Search by Name"], horizontal=True)
-selected_file_only_path = None
-
-if file_selection_method == "Dropdown":
-    selected_file = st.selectbox("Select a File to View", ['Select One'] + file_labels, key="selected_file")
-    if selected_file == "Select One":
-        st.info("Please select a file to view.")
-        st.stop()
-    selected_file_only_path = selected_file.split(" | ")[0]
+_stage_url_len = len(stage_url) if stage_url else 0
+
+def _strip_stage(path: str) -> str:
+    # LS returns full stage URLs; session.file.get wants the path relative to the stage
+    if _stage_url_len and path.startswith(stage_url):
+        return path[_stage_url_len:].lstrip("/")
+    return path
+
+# Reruns triggered inside the file section (method radio, search box, Read File, AI summary)
+# only re-execute this function, not the database/table/stage resolution above it.
+_fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", lambda fn: fn)
+
+@_fragment
+def file_section(resolved_stage: str, files_df, file_labels: list):
+    st.subheader("📄 Select or Search File")
+    file_selection_method = st.radio(
+        "Choose file selection method:", ["Dropdown", "Search by Name"],
+        index=1 if len(file_labels) > MAX_DROPDOWN_FILES else 0, horizontal=True
+    )
+    selected_file_only_path = None
+    selected_name = None  # the LS NAME, kept unstripped for looking up SIZE/LAST_MODIFIED
+
+    if file_selection_method == "Dropdown":
+        if len(file_labels) > MAX_DROPDOWN_FILES:
+            st.caption(f"Showing the first {MAX_DROPDOWN_FILES} of {len(file_labels)} files. Use 'Search by Name' to find others.")
+        selected_file = st.selectbox("Select a File to View", ['Select One'] + file_labels[:MAX_DROPDOWN_FILES], key="selected_file")
+        if selected_file == "Select One":
+            st.info("Please select a file to view.")
+            st.stop()
+        selected_name = selected_file.split(" | ")[0]
+        selected_file_only_path = _strip_stage(selected_name)
 
-    if stage_url and selected_file_only_path.startswith(stage_url):
-        selected_file_only_path = selected_file_only_path[len(stage_url):].lstrip("/")
     else:
-        selected_file_only_path = selected_file_only_path.lstrip("/")
-
-else:
-    partial_name = st.text_input("Enter full or partial file name")
-    if partial_name:
-        matched_files = files_df[files_df['NAME'].str.contains(partial_name, case=False, na=False)]
-        if matched_files.empty:
-            st.warning("No files match the input. Adjust your search.")
-            st.stop()
-        elif len(matched_files) == 1:
-            selected_file_only_path = matched_files['NAME'].iloc[0]
-            st.info(f"Auto-selected single match: {selected_file_only_path}")
-            if stage_url and selected_file_only_path.startswith(stage_url):
-                selected_file_only_path = selected_file_only_path[len(stage_url):].lstrip("/")
+        partial_name = st.text_input("Enter full or partial file name")
+        if partial_name:
+            matched_files = files_df[files_df['NAME'].str.contains(partial_name, case=False, na=False)]
+            if matched_files.empty:
+                st.warning("No files match the input. Adjust your search.")
+                st.stop()
+            elif len(matched_files) == 1:
+                selected_name = matched_files['NAME'].iloc[0]
+                st.info(f"Auto-selected single match: {selected_name}")
+                selected_file_only_path = _strip_stage(selected_name)
             else:
-                selected_file_only_path = selected_file_only_path.lstrip("/")
-        else:
-            selected_choice = st.selectbox("Multiple matches found — choose one", matched_files['LABEL'].tolist())
-            selected_file_only_path = selected_choice.split(" | ")[0]
-            if stage_url and selected_file_only_path.startswith(stage_url):
-                selected_file_only_path = selected_file_only_path[len(stage_url):].lstrip("/")
-            else:
-                selected_file_only_path = selected_file_only_path.lstrip("/")
-
-# ---------- Parquet View Choice ----------
-parquet_view_choice = None
-if selected_file_only_path and selected_file_only_path.lower().endswith(".parquet"):
-    parquet_view_choice = st.radio(
-        "What do you want to display for this Parquet file?",
-        ("Metadata Only", "Sample Data Only", "Both Metadata & Sample Data")
-    )
+                if len(matched_files) > MAX_DROPDOWN_FILES:
+                    st.caption(f"Showing the first {MAX_DROPDOWN_FILES} of {len(matched_files)} matches. Refine the search to narrow them down.")
+                selected_choice = st.selectbox("Multiple matches found — choose one", matched_files['LABEL'].iloc[:MAX_DROPDOWN_FILES].tolist())
+                selected_name = selected_choice.split(" | ")[0]
+                selected_file_only_path = _strip_stage(selected_name)
+
+    # ---------- Parquet View Choice ----------
+    parquet_view_choice = None
+    if selected_file_only_path and selected_file_only_path.lower().endswith(".parquet"):
+        parquet_view_choice = st.radio(
+            "What do you want to display for this Parquet file?",
+            ("Metadata Only", "Sample Data Only", "Both Metadata & Sample Data")
+        )
+
+    # ---------- Read and analyze file ----------
+    if st.button("📖 Read File"):
+        if not selected_file_only_path:
+            st.warning("No file selected.")
+            st.stop()
+        st.session_state.read_file_view = (selected_file_only_path, parquet_view_choice)
+
+    # Keep the file view across reruns (e.g. the AI summary button) until another file or view is selected
+    if selected_file_only_path and st.session_state.get("read_file_view") == (selected_file_only_path, parquet_view_choice):
+        st.success(f"Selected File: {selected_file_only_path}")
+        stage_file = f"@{resolved_stage}/{selected_file_only_path}"
+        file_ext = os.path.splitext(selected_file_only_path)[1].lower().lstrip(".")
+        # Vectorized match on the unstripped NAME; re-stripping the whole listing ran on every rerun of the view
+        file_row = files_df[files_df['NAME'] == selected_name]
+        file_size = int(file_row['SIZE'].iloc[0]) if not file_row.empty and 'SIZE' in file_row.columns else None
+        stage_key = (stage_file, file_size, str(file_row['LAST_MODIFIED'].iloc[0])) if file_size is not None else None
+
+        # The last file read is kept (fetched bytes or parsed records) so reruns from widgets inside
+        # the view (AI summary, raw metadata, row-group picker) neither refetch nor re-parse it
+        read_cache = st.session_state.get("_read_file")
+        if (stage_key is None or read_cache is None or read_cache["stage_key"] != stage_key
+                or (read_cache["parsed"] is None and isinstance(read_cache["source"], str)
+                    and not os.path.exists(read_cache["source"]))):
+            read_cache = {"stage_key": stage_key, "source": None, "file_key": None, "parsed": None}
 
-# ---------- Read and analyze file ----------
-if st.button("📖 Read File"):
-    if not selected_file_only_path:
-        st.warning("No file selected.")
-        st.stop()
-    st.success(f"Selected File: {selected_file_only_path}")
-    tmp_dir = tempfile.mkdtemp(prefix="sf_stage_")
-    local_file_path = os.path.join(tmp_dir, os.path.basename(selected_file_only_path))
-    file_ext = os.path.splitext(local_file_path)[1].lower().lstrip(".")
+        try:
+            with st.spinner("Downloading file from stage..."):
+                if read_cache["source"] is not None or read_cache["parsed"] is not None:
+                    source, file_key = read_cache["source"], read_cache["file_key"]
+                elif (file_ext == "parquet" and parquet_view_choice == "Metadata Only"
+                        and stage_key in st.session_state.get("_pq_meta", {})):
+                    # Already parsed this session; the metadata view needs nothing from the file itself
+                    source = file_key = None
+                elif file_size is not None and file_size <= IN_MEMORY_MAX_BYTES:
+                    source = io.BytesIO(session.file.get_stream(stage_file).read())
+                    file_key = stage_key
+                else:
+                    source = download_to_scratch(stage_file, stage_key)
+                    file_key = (source, os.path.getmtime(source), os.path.getsize(source))
+                if source is not None and stage_key is not None:
+                    read_cache.update(source=source, file_key=file_key)
+                    st.session_state["_read_file"] = read_cache
+
+            with st.spinner("Reading file..."):
+                if file_ext in ["json", "ndjson"]:
+                    if read_cache["parsed"] is not None:
+                        records, obj, truncated = read_cache["parsed"]
+                    else:
+                        records = []
+                        obj = None
+                        truncated = False
+                        with open_source(source) as f:
+                            data = f.read()
+                        try:
+                            obj = json_loads(data)
+                            records = obj if isinstance(obj, list) else [obj]
+                            if len(records) > PREVIEW_LIMIT:
+                                # Same cap as NDJSON; the raw view then shows the previewed slice, not the whole array
+                                records, obj, truncated = records[:PREVIEW_LIMIT], None, True
+                        except json.JSONDecodeError:  # orjson's error subclasses it
+                            for line in data.splitlines():
+                                line = line.strip()
+                                if not line:
+                                    continue
+                                if len(records) >= PREVIEW_LIMIT:
+                                    truncated = True
+                                    break
+                                try:
+                                    records.append(json_loads(line))
+                                except Exception:
+                                    records.append({"raw_line": line.decode("utf-8", "replace")})
+                        # The parsed document replaces the fetched bytes in the session
+                        read_cache.update(source=None, parsed=(records, obj, truncated))
+                    render_json_avro_view(records, raw_obj=obj, truncated=truncated)
+                    with st.expander("📌 **AI Summary**", expanded=False):
+                        if st.button("Generate AI summary", key=f"ai_{file_ext}"):
+                            st.text(safe_cortex_call(records))
+
+                elif file_ext == "avro":
+                    if read_cache["parsed"] is not None:
+                        records, truncated = read_cache["parsed"]
+                    else:
+                        records = []
+                        decoded_bytes = 0
+                        truncated = False
+                        with open_source(source) as f:
+                            # Bounded by record count and by encoded size, so wide records can't exhaust memory
+                            blocks = fastavro.block_reader(f)
+                            for block in blocks:
+                                records.extend(block)
+                                decoded_bytes += block.size
+                                if len(records) >= PREVIEW_LIMIT or decoded_bytes >= PREVIEW_MAX_BYTES:
+                                    # Stopping exactly at the last block drops nothing
+                                    truncated = len(records) > PREVIEW_LIMIT or next(blocks, None) is not None
+                                    del records[PREVIEW_LIMIT:]
+                                    break
+                        read_cache.update(source=None, parsed=(records, truncated))
+                    render_json_avro_view(records, truncated=truncated)
+                    with st.expander("📌 **AI Summary**", expanded=False):
+                        if st.button("Generate AI summary", key=f"ai_{file_ext}"):
+                            st.text(safe_cortex_call(records))
+
+                elif file_ext == "parquet":
+                    # Parsed at most once per file per session: up front for the metadata view, else only for the AI summary
+                    metadata_dict = None
+                    if parquet_view_choice in ["Metadata Only", "Both Metadata & Sample Data"]:
+                        metadata_dict, footer, file_key = load_parquet_metadata(source, file_key, stage_key)
+                        render_parquet_view(metadata_dict, footer, file_key)
+
+                    with st.expander("📌 AI Summary", expanded=False):
+                        if st.button("Generate AI summary", key=f"ai_{file_ext}"):
+                            if metadata_dict is None:
+                                metadata_dict = load_parquet_metadata(source, file_key, stage_key)[0]
+                            st.text(safe_cortex_call(metadata_dict))
+
+                    if parquet_view_choice in ["Sample Data Only", "Both Metadata & Sample Data"]:
+                        st.subheader("📑 Sample Data")
+                        # Only decode the rows shown instead of materializing the whole file
+                        pf = pq.ParquetFile(arrow_source(source), memory_map=isinstance(source, str))
+                        batch = next(pf.iter_batches(batch_size=SAMPLE_ROWS), None)
+                        if batch is not None:
+                            # ArrowDtype (pandas 2.x) wraps the Arrow buffers instead of copying into NumPy
+                            st.dataframe(batch.to_pandas(
+                                self_destruct=True, split_blocks=True, types_mapper=getattr(pd, "ArrowDtype", None)
+                            ))
+                        else:
+                            st.write("No rows available in this file.")
+
+                else:
+                    st.warning(f"Unsupported file type: .{file_ext}")
 
-    try:
-        with st.spinner("Downloading file from stage..."):
-            session.file.get(f"@{resolved_stage}/{selected_file_only_path}", tmp_dir)
-
-        with st.spinner("Reading and Generating AI Summary for file..."):
-            if file_ext in ["json", "ndjson"]:
-                records = []
-                with open(local_file_path, "r", encoding="utf-8") as f:
-                    try:
-                        obj = json.load(f)
-                        records = obj if isinstance(obj, list) else [obj]
-                    except json.JSONDecodeError:
-                        f.seek(0)
-                        for line in f:
-                            line = line.strip()
-                            if not line:
-                                continue
-                            try:
-                                records.append(json.loads(line))
-                            except Exception:
-                                records.append({"raw_line": line})
-                render_json_avro_view(records, local_file_path)
-                with st.expander("📌 **AI Summary**", expanded=False):
-                    ai_summary = safe_cortex_call(records)
-                    st.text(ai_summary)
-
-            elif file_ext == "avro":
-                records = []
-                with open(local_file_path, 'rb') as f:
-                    reader = fastavro.reader(f)
-                    for i, record in enumerate(reader):
-                        records.append(record)
-                        if i >= 9999999:
-                            break
-                render_json_avro_view(records, local_file_path)
-                with st.expander("📌 **AI Summary**", expanded=False):
-                    ai_summary = safe_cortex_call(records)
-                    st.text(ai_summary)
-
-            elif file_ext == "parquet":
-                if parquet_view_choice in ["Metadata Only", "Both Metadata & Sample Data"]:
-                    metadata_dict = show_parquet_metadata(local_file_path)
-                    render_parquet_view(metadata_dict)
-
-                with st.expander("📌 AI Summary", expanded=False):
-                    metadata_dict = show_parquet_metadata(local_file_path)
-                    ai_summary = safe_cortex_call(metadata_dict)
-                    st.text(ai_summary)
-
-                if parquet_view_choice in ["Sample Data Only", "Both Metadata & Sample Data"]:
-                    st.subheader("📑 Sample Data")
-                    df_sample = pd.read_parquet(local_file_path)
-                    st.dataframe(df_sample.head(100))
+        except Exception as e:
+            st.error(f"Error reading or analyzing file: {e}")
 
-            else:
-                st.warning(f"Unsupported file type: .{file_ext}")
 
-    except Exception as e:
-        st.error(f"Error reading or analyzing file: {e}")
-    finally:
-        try:
-            shutil.rmtree(tmp_dir)
-        except Exception:
-            pass
+file_section(resolved_stage, files_df, file_labels)